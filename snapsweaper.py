@@ -1,110 +1,310 @@
 import os
 import re
+import sys
 import argparse
+import asyncio
 import base64
+import errno
+import hashlib
+import mmap
+import sqlite3
+import time
+import unicodedata
 import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from io import BytesIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json  # 用于格式化JSON输出
 
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时使用标准库 json
+    orjson = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 为可选依赖，未安装时直接上传原图
+    Image = None
+
+# API request builders
+PNG_MIME = "image/png"
+JPEG_MIME = "image/jpeg"
+
+def bearer_headers(key):
+    """Bearer Token 认证的请求头"""
+    return {
+        "Authorization": f"Bearer {key}",
+        "Content-Type": "application/json"
+    }
+
+def plain_headers(key):
+    """无需认证的请求头"""
+    return {
+        "Content-Type": "application/json"
+    }
+
+def chat_content(prompt, image_data, mime=PNG_MIME):
+    """Chat Completions 消息内容：提示语加图片，data URL 前缀只在此处添加
+
+    image_data 为空时（文件名生成）只发送文字，不附带空图片
+    """
+    content = [{"type": "text", "text": prompt}]
+    if image_data:
+        content.append(chat_image_part(image_data, mime))
+    return content
+
+def chat_image_part(image_data, mime=PNG_MIME):
+    """Chat Completions 消息中的图片部分"""
+    return {"type": "image_url", "image_url": {
+        "url": f"data:{mime};base64,{image_data}"
+    }}
+
+def openai_payload(model, prompt, image_data, mime=PNG_MIME):
+    """OpenAI 请求体"""
+    return {
+        "model": model,
+        "messages": [{
+            "role": "user",
+            "content": chat_content(prompt, image_data, mime)
+        }],
+        "max_tokens": 100
+    }
+
+def openai_batch_payload(model, prompt, images):
+    """OpenAI 批量识别请求体，images 为 [(image_data, mime), ...]"""
+    return {
+        "model": model,
+        "messages": [{
+            "role": "user",
+            "content": [{"type": "text", "text": prompt}] + [
+                chat_image_part(image_data, mime) for image_data, mime in images
+            ]
+        }],
+        "max_tokens": 50 * len(images)
+    }
+
+def dashscope_payload(model, prompt, image_data, mime=PNG_MIME):
+    """DashScope 请求体"""
+    return {
+        "model": model,
+        "messages": [{
+            "role": "user",
+            "content": chat_content(prompt, image_data, mime)
+        }]
+    }
+
+def dashscope_batch_payload(model, prompt, images):
+    """DashScope 批量识别请求体，images 为 [(image_data, mime), ...]"""
+    return {
+        "model": model,
+        "messages": [{
+            "role": "user",
+            "content": [{"type": "text", "text": prompt}] + [
+                chat_image_part(image_data, mime) for image_data, mime in images
+            ]
+        }]
+    }
+
+def ollama_payload(model, prompt, image_data, mime=PNG_MIME):
+    """Ollama 请求体"""
+    return {
+        "model": model,
+        "prompt": prompt,
+        "images": [image_data],
+        "stream": True,  # 逐段返回，生成结束即可读完
+        "options": {
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "num_predict": 50  # 限制输出长度
+        }
+    }
+
+def chat_response(r):
+    """解析 Chat Completions 格式的响应"""
+    return r['choices'][0]['message']['content']
+
+def ollama_response(r):
+    """解析 Ollama 响应"""
+    return r['response'].strip()
+
 # API Configuration
 API_CONFIGS = {
     'openai': {  # OpenAI GPT-4 Vision
         'base_url': "https://api.openai.com/v1/chat/completions",
         'model': "gpt-4-vision-preview",
         'key_env': "OPENAI_API_KEY",
-        'headers': lambda key: {
-            "Authorization": f"Bearer {key}",
-            "Content-Type": "application/json"
-        },
-        'payload_format': lambda prompt, image_data: {
-            "model": "gpt-4-vision-preview",
-            "messages": [{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "url": f"data:image/png;base64,{image_data}"}
-                ]
-            }],
-            "max_tokens": 100
-        },
-        'response_parser': lambda r: r['choices'][0]['message']['content']
+        'upload_mode': 'base64',  # base64 内嵌于 JSON，或 'multipart' 二进制上传
+        'headers': bearer_headers,
+        'payload_format': openai_payload,
+        'batch_payload_format': openai_batch_payload,  # 单个请求识别多张图片，可选
+        'response_parser': chat_response
     },
     'dashscope': {  # Aliyun DashScope
         'base_url': "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
         'model': "qwen-vl-max",
         'key_env': "DASHSCOPE_API_KEY",
-        'headers': lambda key: {
-            "Authorization": f"Bearer {key}",
-            "Content-Type": "application/json"
-        },
-        'payload_format': lambda prompt, image_data: {
-            "model": "qwen-vl-max",
-            "messages": [{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {
-                        "url": f"data:image/png;base64,{image_data}"
-                    }}
-                ]
-            }]
-        },
-        'response_parser': lambda r: r['choices'][0]['message']['content']
+        'upload_mode': 'base64',
+        'headers': bearer_headers,
+        'payload_format': dashscope_payload,
+        'batch_payload_format': dashscope_batch_payload,
+        'response_parser': chat_response
     },
     'ollama': {  # Local Ollama
         'base_url': "http://localhost:11434/api/generate",
         'model': "llama3.2-vision",
         'key_env': None,
-        'headers': lambda key: {
-            "Content-Type": "application/json"
-        },
-        'payload_format': lambda prompt, image_data: {
-            "model": "llama3.2-vision",
-            "prompt": prompt,
-            "images": [image_data],
-            "stream": False,
-            "options": {
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "num_predict": 50  # 限制输出长度
-            }
-        },
-        'response_parser': lambda r: r['response'].strip()
+        'upload_mode': 'base64',
+        'headers': plain_headers,
+        'payload_format': ollama_payload,
+        'response_parser': ollama_response
     }
 }
 
+# 本地识别与文件名生成所需的 Ollama 模型
+OLLAMA_REQUIRED_MODELS = ('llama3.2-vision', 'qwen2.5:32b')
+
+# Prompts
+# 第一步图片识别统一输出英文描述，与目标语言无关
+OLLAMA_VISION_PROMPT = (
+    "You are an image classifier. "
+    "Identify the main subject or category of this image in one short phrase. "
+    "Focus on WHAT this image is about, not the details. "
+    "\n\nExamples:"
+    "\nBad: 'A red bicycle parked against a wall with a chain lock'\n"
+    "Good: 'Bicycle parking'\n\n"
+    "Bad: 'A soccer match with players running after the ball on a green field'\n"
+    "Good: 'Soccer game'\n\n"
+    "Bad: 'Code editor window showing Python syntax with dark theme'\n"
+    "Good: 'Code editor'\n\n"
+    "If you cannot identify the image clearly, just reply 'skip'"
+)
+VISION_PROMPT = (
+    "What is the main subject or category of this image? "
+    "Give a short, concise answer focusing on the core content. "
+    "No details, just the essence."
+)
+BATCH_VISION_PROMPT = (
+    "You will be shown {count} images. "
+    "For each image, in order, give its main subject or category as a short phrase. "
+    "No details, just the essence. "
+    "Reply with exactly {count} lines, one per image, numbered '1.', '2.', and so on, "
+    "with no other text. If you cannot identify an image, write 'skip' on its line."
+)
+# 批量识别回复中每行开头的编号，如 "1." "2)" "- "
+BATCH_LINE_PREFIX_RE = re.compile(r'^\s*(?:\d+\s*[.):：、]|[-*•])\s*')
+# 第二步文件名生成的目标语言
+FILENAME_LANGUAGES = {
+    'zh-cn': "简体中文",
+    'zh-tw': "繁体中文",
+    'en': "英文",
+    'jp': "日文"
+}
+
 # Configuration
 LANGUAGE = os.getenv('RENAME_LANG', 'zh-tw')  # Default to Traditional Chinese
 API_PROVIDER = os.getenv('API_PROVIDER', 'openai')  # Default to OpenAI
 API_CONFIG = None
 API_KEY = None
+HEADERS = None  # 请求头只依赖 API 金钥，启动时生成一次
 DEBUG_MODE = False
+RESIZE_IMAGES = True
+BANNER = '=' * 50  # 每个文件输出前后的分隔线
+DEFAULT_CONCURRENCY = 8  # 同时进行中的 API 请求数上限（Ollama 为每个模型），避免触发 API 限流
+
+# 截图文件名模式：Screen Shot-YYYY-MM-DD... 或 SCR-YYYYMMDD...（第 2 组为日期）
+SCREENSHOT_RE = re.compile(r"^(Screen Shot|SCR)-(\d{4}(-\d{2}){2}|\d{8})")
+IMAGE_EXTS = frozenset({'.png', '.jpg', '.jpeg'})
+# 模型输出清理规则
+SPECIAL_CHARS_RE = re.compile(r'[^\w\u4e00-\u9fff\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# 上传前缩图：视觉模型识别主题不需要原始分辨率
+RESIZE_MAX_DIM = 1024  # 长边上限，可用 --max-dim 调整
+RESIZE_JPEG_QUALITY = 85
+# 不缩图直接上传原图时的大小上限，超过的图片 API 多半会拒绝，提前跳过
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+# 请求体模板中图片数据的占位符，序列化后原样保留，便于拼入 base64
+IMAGE_PLACEHOLDER = "__SNAPSWEAPER_IMAGE__"
+
+# 调试输出中超过此长度的字符串/列表（图片 base64、Ollama context 等）只显示摘要
+DEBUG_MAX_LEN = 1024
+
+# 共用 HTTP 会话：复用 TCP/TLS 连接，避免每次请求重新握手
+SESSION = requests.Session()
+
+def mount_adapter(pool_maxsize):
+    """为共用会话设置连接池与重试策略
+
+    pool_maxsize 需不小于同时进行的请求数，否则多余连接用完即弃
+    """
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=pool_maxsize,
+        # urllib3 默认不重试 POST，识别与命名请求需显式允许；
+        # 读取超时时服务端多半已在处理（并计费），不重试，只重试连接失败与 429/5xx
+        max_retries=Retry(total=5, read=0, backoff_factor=0.5,
+                          status_forcelist=[429, 500, 502, 503, 504],
+                          allowed_methods=["GET", "POST"])
+    )
+    SESSION.mount('https://', adapter)
+    SESSION.mount('http://', adapter)
+
+# Ollama 两个阶段各自并发，最多同时 2 倍并发数个请求；main 按 --concurrency 重新设置
+mount_adapter(2 * DEFAULT_CONCURRENCY)
+
+# 结果缓存：图片识别按图片内容 SHA-256、文件名生成按识别结果缓存，重复运行时跳过 API 调用
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'snapsweaper', 'cache.sqlite')
+SKIP_CACHE_TTL = 24 * 3600  # 模型回复 skip 的结果只缓存一天，之后重新请求
+CACHE_COMMIT_EVERY = 32  # 每写入若干条提交一次，不长期占用写锁，同时运行的其他实例也能写入
+CACHE_LOCK_TIMEOUT = 1  # 缓存在事件循环线程中读写，等待其他实例释放锁的时间不宜过长
+
+def json_dumps(obj):
+    """将请求体序列化为 UTF-8 bytes，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+def json_loads(data):
+    """解析 JSON 响应，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_pretty(obj):
+    """调试输出用：缩进格式的 JSON 字符串，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+def redact_for_debug(obj):
+    """调试输出用：将过长的字符串和列表替换为摘要，避免完整序列化图片数据"""
+    if isinstance(obj, dict):
+        return {k: redact_for_debug(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        if len(obj) > DEBUG_MAX_LEN:
+            return f"<{len(obj)} items omitted>"
+        return [redact_for_debug(v) for v in obj]
+    if isinstance(obj, str) and len(obj) > DEBUG_MAX_LEN:
+        return f"{obj[:32]}...<{len(obj)} chars omitted>"
+    return obj
 
 def check_ollama_service():
     """Check if Ollama service is running and required models are available"""
     try:
-        # 检查服务是否运行
-        response = requests.get("http://localhost:11434/", timeout=2)
-        if response.status_code != 200:
-            raise Exception("Ollama service is not running")
-        
-        # 检查模型是否已安装
+        # 模型列表接口能正常返回即说明服务在运行，一次请求同时完成两项检查；
+        # 不经过带重试的 SESSION，服务未启动时立即报错
         response = requests.get("http://localhost:11434/api/tags", timeout=2)
         if response.status_code != 200:
-            raise Exception("Cannot check available models")
-        
-        models = response.json()
-        required_models = {
-            'llama3.2-vision': False,
-            'qwen2.5:32b': False
-        }
-        
-        for model in models['models']:
-            for required in required_models:
-                if required in model['name']:
-                    required_models[required] = True
+            raise Exception("Ollama service is not running")
         
-        missing_models = [name for name, found in required_models.items() if not found]
+        # 已安装模型名只取一次；每个所需模型找到匹配即停止扫描
+        names = [model['name'] for model in json_loads(response.content)['models']]
+        missing_models = [required for required in OLLAMA_REQUIRED_MODELS
+                          if not any(required in name for name in names)]
         if missing_models:
             raise Exception(f"Missing required models: {', '.join(missing_models)}")
             
@@ -113,324 +313,761 @@ def check_ollama_service():
     except Exception as e:
         raise Exception(f"Ollama service error: {str(e)}")
 
-def get_image_content(image_path):
-    """First step: Get detailed image content in English"""
+@contextmanager
+def map_file(path):
+    """以只读内存映射打开文件，内容直接来自页缓存而不复制到 Python 堆中"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''  # 空文件无法映射
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def b64_file(path):
+    """对文件内容进行 base64 编码，返回 ASCII bytes"""
+    with map_file(path) as data:
+        return base64.b64encode(data)
+
+def image_mime(path):
+    """根据文件头判断图片格式并返回 MIME 类型，不是 PNG/JPEG 时抛出 ValueError"""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if head == b'\x89PNG\r\n\x1a\n':
+        return PNG_MIME
+    if head[:2] == b'\xff\xd8':
+        return JPEG_MIME
+    raise ValueError("Not a PNG or JPEG image")
+
+def check_upload_size(path):
+    """上传原图前检查文件大小"""
+    size = os.path.getsize(path)
+    if size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Image too large to upload without resizing ({size} bytes)")
+
+def check_upload(path):
+    """分段上传原图前的检查：格式不符或过大时抛出 ValueError"""
+    image_mime(path)
+    check_upload_size(path)
+
+def encode_image(image_path):
+    """读取图片并进行 base64 编码，返回 (编码结果 bytes, MIME 类型)
+
+    先检查文件头，非图片文件在读取全文及编码前即被拒绝
+    """
+    mime = image_mime(image_path)
+    if RESIZE_IMAGES and Image is not None:
+        with Image.open(image_path) as img:
+            img.thumbnail((RESIZE_MAX_DIM, RESIZE_MAX_DIM), Image.LANCZOS)
+            buf = BytesIO()
+            img.convert('RGB').save(buf, 'JPEG', quality=RESIZE_JPEG_QUALITY, optimize=True)
+        return base64.b64encode(buf.getbuffer()), JPEG_MIME
+    check_upload_size(image_path)
+    return b64_file(image_path), mime
+
+@lru_cache(maxsize=None)
+def payload_template(provider, prompt, mime):
+    """单图请求体模板：以图片占位符分为前后两段已序列化的 bytes
+
+    同一次运行中提供商与提示语不变，请求体的固定部分只需序列化一次
+    """
+    config = API_CONFIGS[provider]
+    body = json_dumps(config['payload_format'](config['model'], prompt, IMAGE_PLACEHOLDER, mime))
+    head, tail = body.split(IMAGE_PLACEHOLDER.encode('ascii'))
+    return head, tail
+
+def image_payload(prompt, image_data, mime):
+    """组装单图请求体：base64 字符无需 JSON 转义，直接拼入模板，不再解码或重新序列化"""
+    head, tail = payload_template(API_PROVIDER, prompt, mime)
+    return b''.join((head, image_data, tail))
+
+def hash_file(path):
+    """计算文件内容的 SHA-256，作为缓存键"""
+    with map_file(path) as data:
+        return hashlib.sha256(data).hexdigest()
+
+def open_cache(path=CACHE_PATH):
+    """打开结果缓存数据库，不存在时自动创建"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=CACHE_LOCK_TIMEOUT)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+    )
+    return conn
+
+def content_cache_key(digest):
+    """图片识别结果的缓存键：图片内容 + API 提供商"""
+    return f"content:{API_PROVIDER}:{digest}"
+
+def filename_cache_key(content):
+    """文件名生成结果的缓存键：识别结果 + 输出语言 + API 提供商"""
+    raw = f"{API_PROVIDER}\0{LANGUAGE}\0{content}".encode('utf-8')
+    return f"filename:{hashlib.sha256(raw).hexdigest()}"
+
+def cache_get(cache, key):
+    """查询缓存，未命中或 skip 结果已过期时返回 None；缓存出错视为未命中"""
+    if cache is None:
+        return None
+    try:
+        row = cache.execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    value, created = row
+    if is_skip(value) and time.time() - created > SKIP_CACHE_TTL:
+        return None
+    return value
+
+def cache_put(cache, key, value):
+    """写入缓存，每 CACHE_COMMIT_EVERY 条提交一次以减少 fsync；缓存出错时忽略
+
+    请求失败（None）及清理后为空、无法用作文件名的结果不缓存，下次重新请求
+    """
+    if cache is None or value is None or not sanitize_description(value).strip('_-'):
+        return
+    try:
+        cache.execute(
+            "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+            (key, value, time.time())
+        )
+        if cache.total_changes % CACHE_COMMIT_EVERY == 0:
+            cache.commit()
+    except sqlite3.Error:
+        # 缓存只是加速，写入失败（如被其他实例锁定）不影响文件处理；
+        # 回滚以释放本连接持有的锁，未提交的少量结果下次重新请求即可
+        try:
+            cache.rollback()
+        except sqlite3.Error:
+            pass
+
+def get_image_content(image_path, encoded=None):
+    """First step: Get detailed image content in English
+
+    encoded is the (base64 bytes, mime) pair from encode_image, if already prepared.
+    Returns 'skip' if the model cannot identify the image, None if the request fails.
+    """
     try:
         if API_CONFIG['key_env'] and not API_KEY:
             raise ValueError(f"Missing API key. Please set {API_CONFIG['key_env']}")
 
-        if API_PROVIDER == 'ollama':
-            check_ollama_service()
-
-        with open(image_path, "rb") as f:
-            base64_data = base64.b64encode(f.read()).decode("utf-8")
-            
-            if API_PROVIDER != 'ollama':
-                base64_data = f"data:image/png;base64,{base64_data}"
-        
         # 根据不同的 API 提供商使用不同的提示语
-        language_requests = {
-            'zh-cn': "Simplified Chinese (简体中文)",
-            'zh-tw': "Traditional Chinese (繁體中文)",
-            'en': "English",
-            'jp': "Japanese (日本語)"
-        }
+        prompt = OLLAMA_VISION_PROMPT if API_PROVIDER == 'ollama' else VISION_PROMPT
         
-        if API_PROVIDER == 'ollama':
-            prompt = (
-                "You are an image classifier. "
-                "Identify the main subject or category of this image in one short phrase. "
-                "Focus on WHAT this image is about, not the details. "
-                "\n\nExamples:"
-                "\nBad: 'A red bicycle parked against a wall with a chain lock'\n"
-                "Good: 'Bicycle parking'\n\n"
-                "Bad: 'A soccer match with players running after the ball on a green field'\n"
-                "Good: 'Soccer game'\n\n"
-                "Bad: 'Code editor window showing Python syntax with dark theme'\n"
-                "Good: 'Code editor'\n\n"
-                "If you cannot identify the image clearly, just reply 'skip'"
-            )
+        headers = HEADERS
+        timeout = 60 if API_PROVIDER == 'ollama' else 20
+        stream = API_PROVIDER == 'ollama'  # Ollama 逐段返回，见 read_ollama_stream
+        
+        if API_CONFIG['upload_mode'] == 'multipart':
+            # 以二进制分段上传原图，省去 base64 编码及约 33% 的体积膨胀
+            headers = {k: v for k, v in headers.items() if k != "Content-Type"}
+            mime = image_mime(image_path)
+            check_upload_size(image_path)
+            
+            if DEBUG_MODE:
+                print("\n🔍 Debug Information (Content Recognition):")
+                print(f"API URL: {API_CONFIG['base_url']}")
+                print(f"Headers: {json_pretty(headers)}")
+            
+            with open(image_path, "rb") as f:
+                response = SESSION.post(
+                    API_CONFIG['base_url'],
+                    files={'image': (os.path.basename(image_path), f, mime)},
+                    data={'prompt': prompt, 'model': API_CONFIG['model']},
+                    headers=headers,
+                    timeout=timeout,
+                    stream=stream
+                )
         else:
-            prompt = (
-                "What is the main subject or category of this image? "
-                "Give a short, concise answer focusing on the core content. "
-                "No details, just the essence."
+            # data: URL 前缀由请求体构造函数在组装时加上，这里不再复制一份带前缀的字符串
+            base64_data, mime = encoded or encode_image(image_path)
+            
+            if DEBUG_MODE:
+                payload = API_CONFIG['payload_format'](
+                    API_CONFIG['model'], prompt, f"<{len(base64_data)} base64 bytes>", mime
+                )
+                print("\n🔍 Debug Information (Content Recognition):")
+                print(f"API URL: {API_CONFIG['base_url']}")
+                print(f"Headers: {json_pretty(headers)}")
+                print(f"Payload: {json_pretty(payload)}")
+            
+            response = SESSION.post(
+                API_CONFIG['base_url'],
+                data=image_payload(prompt, base64_data, mime),
+                headers=headers,
+                timeout=timeout,
+                stream=stream
             )
         
-        headers = API_CONFIG['headers'](API_KEY)
-        payload = API_CONFIG['payload_format'](prompt, base64_data)
-        
-        if DEBUG_MODE:
-            print("\n🔍 Debug Information (Content Recognition):")
-            print(f"API URL: {API_CONFIG['base_url']}")
-            print(f"Headers: {json.dumps(headers, indent=2)}")
-            print(f"Payload: {json.dumps(payload, indent=2)}")
-        
-        timeout = 60 if API_PROVIDER == 'ollama' else 20
-        response = requests.post(
-            API_CONFIG['base_url'],
-            json=payload,
-            headers=headers,
-            timeout=timeout
-        )
-        
         if response.status_code != 200:
             if DEBUG_MODE:
                 print(f"Error response body: {response.text}")
+            response.close()  # 流式响应未读完，关闭以归还连接
             raise Exception(f"API Error: Status {response.status_code}")
             
-        result = response.json()
+        result = read_ollama_stream(response) if stream else json_loads(response.content)
         content = API_CONFIG['response_parser'](result)
         
         if DEBUG_MODE:
             print("\n🔍 Step 1 - Image Recognition:")
             print(f"Result: {content}")
         
-        # 检查是否为无效响应
-        if not content or content.lower() == 'skip' or len(content) < 3:
-            return None
-            
-        return content
+        return check_content(content)
         
     except Exception as e:
         if DEBUG_MODE:
             print(f"⚠️ Content recognition failed: {str(e)}")
         return None
 
-def generate_filename(content):
-    """Second step: Generate concise filename in target language"""
+def read_ollama_stream(response):
+    """逐行读取 Ollama 的流式响应（NDJSON），拼接 response 字段，读到 done 即停止
+
+    返回与非流式响应相同结构的 {'response': ...}，可直接交给 response_parser
+    """
+    parts = []
     try:
-        if not content:
-            return None
-            
-        language_requests = {
-            'zh-cn': "简体中文",
-            'zh-tw': "繁体中文",
-            'en': "英文",
-            'jp': "日文"
-        }
-            
-        if API_PROVIDER == 'ollama':
-            payload = {
-                "model": "qwen2.5:32b",
-                "prompt": (
-                    f"任务：将英文描述转换为{language_requests[LANGUAGE]}文件名\n\n"
-                    f"描述：{content}\n\n"
-                    f"要求：\n"
-                    f"1. 建议长度在10个字符以内\n"
-                    f"2. 保留最核心的含义\n"
-                    f"3. 不要解释和标点\n"
-                    f"4. 无法总结时输出skip\n\n"
-                    f"示例：\n"
-                    f"输入：Code editor with Python syntax highlighting\n"
-                    f"输出：编程器\n\n"
-                    f"输入：Soccer match between two teams on field\n"
-                    f"输出：足球赛\n\n"
-                    f"输入：Bicycle parking in front of building\n"
-                    f"输出：单车位\n\n"
-                    f"直接输出文件名："
-                ),
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,
-                    "top_p": 0.9,
-                    "num_predict": 10,
-                    "stop": ["\n", "。", "，", ".", ",", "：", "\"", "'"]
-                }
-            }
-            
-            if DEBUG_MODE:
-                print("\n🔍 Step 2 - Filename Generation:")
-                print(f"Input content: {content}")
-                print(f"Using model: qwen2.5:32b")
-                
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=20
-            )
-            
-            if response.status_code != 200:
-                if DEBUG_MODE:
-                    print(f"Error response: {response.text}")
-                return None
-                
-            result = response.json()
-            if DEBUG_MODE:
-                print(f"Raw response: {result}")
-                
-            # 清理响应文本
-            filename = result.get('response', '').strip()
-            filename = re.sub(r'[^\w\u4e00-\u9fff\s]', '', filename)  # 移除特殊字符
-            filename = re.sub(r'\s+', ' ', filename).strip()  # 规范化空格
-            
-            if DEBUG_MODE:
-                print(f"Cleaned filename: {filename}")
-            
-            # 只检查基本错误
-            if not filename or filename.lower() == 'skip':
-                print("❌ 错误：模型无法生成合适的文件名")
-                return None
-            
-            return filename
-            
-        # 对于其他 API，使用原来的方式
-        prompt = (
-            f"Based on this description: '{content}'\n"
-            f"Create a very concise filename in {language_requests[LANGUAGE]}.\n"
-            f"Requirements:\n"
-            f"- For Chinese: exactly 2-4 characters\n"
-            f"- For other languages: exactly 2-3 words\n"
-            f"- No sentences, no articles\n"
-            f"- Only core meaning\n"
-            f"Examples:\n"
-            f"- '代码编辑器' not '这是一个代码编辑器界面'\n"
-            f"- 'Tokyo Station' not 'This is Tokyo Station'\n"
-            f"If unsure, reply 'skip'"
-        )
-        
-        headers = API_CONFIG['headers'](API_KEY)
-        payload = API_CONFIG['payload_format'](prompt, "")
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json_loads(line)
+            if 'error' in chunk:
+                raise Exception(f"Ollama error: {chunk['error']}")
+            parts.append(chunk.get('response', ''))
+            if chunk.get('done'):
+                break
+    finally:
+        response.close()
+    return {'response': ''.join(parts)}
+
+def is_skip(text):
+    """模型回复是否为 skip，忽略大小写、空白与标点（如 'Skip'、'skip.'）"""
+    return SPECIAL_CHARS_RE.sub('', text).strip().lower() == 'skip'
+
+def check_content(content):
+    """检查是否为无效响应，无效时返回 'skip'"""
+    if not content or is_skip(content) or len(content) < 3:
+        return 'skip'
+    return content
+
+def get_images_content(image_paths, encoded=None):
+    """Batched first step: recognize several images in a single request
+
+    encoded holds the encode_image results for image_paths, if already prepared.
+    Returns results in input order, or None if the request fails or the reply
+    cannot be matched line by line to the images.
+    """
+    try:
+        if encoded is None:
+            encoded = [encode_image(path) for path in image_paths]
+        images = [(data.decode('ascii'), mime) for data, mime in encoded]
+        prompt = BATCH_VISION_PROMPT.format(count=len(images))
+        payload = API_CONFIG['batch_payload_format'](API_CONFIG['model'], prompt, images)
         
         if DEBUG_MODE:
-            print("\n🔍 Debug Information (Filename Generation):")
-            print(f"Content: {content}")
-            print(f"Prompt: {prompt}")
+            print("\n🔍 Debug Information (Batch Content Recognition):")
+            print(f"API URL: {API_CONFIG['base_url']}")
+            print(f"Payload: {json_pretty(redact_for_debug(payload))}")
         
-        response = requests.post(
+        response = SESSION.post(
             API_CONFIG['base_url'],
-            json=payload,
-            headers=headers,
-            timeout=20
+            data=json_dumps(payload),
+            headers=HEADERS,
+            timeout=20 * len(images)
         )
         
         if response.status_code != 200:
+            if DEBUG_MODE:
+                print(f"Error response body: {response.text}")
             raise Exception(f"API Error: Status {response.status_code}")
-            
-        result = response.json()
-        return API_CONFIG['response_parser'](result)
+        
+        result = json_loads(response.content)
+        reply = API_CONFIG['response_parser'](result)
+        
+        if DEBUG_MODE:
+            print("\n🔍 Step 1 - Batch Image Recognition:")
+            print(f"Result: {reply}")
+        
+        lines = [line for line in reply.splitlines() if line.strip()]
+        if len(lines) != len(image_paths):
+            raise Exception(f"Expected {len(image_paths)} lines, got {len(lines)}")
+        
+        return [check_content(BATCH_LINE_PREFIX_RE.sub('', line).strip()) for line in lines]
         
     except Exception as e:
-        print(f"❌ 错误：{str(e)}")
+        if DEBUG_MODE:
+            print(f"⚠️ Batch content recognition failed: {str(e)}")
         return None
 
-def process_filename(image_path):
-    """处理文件名并生成新名称"""
-    filename = os.path.basename(image_path)
-    dir_path = os.path.dirname(image_path)
-    
-    # 匹配文件名模式
-    old_format = re.match(r"^(Screen Shot|SCR)-(\d{4}(-\d{2}){2}|\d{8})", filename)
-    if not old_format:
+def generate_filename(content):
+    """Second step: Generate concise filename in target language
+
+    Identical descriptions within a run are answered from memory.
+    Returns 'skip' if the model cannot summarize the content; raises if the request fails.
+    """
+    if not content:
         return None
+    return request_filename(content, LANGUAGE, API_PROVIDER)
+
+@lru_cache(maxsize=4096)
+def request_filename(content, language, provider):
+    """Ask the model for a filename; raises on failure so errors are not memoized"""
+    target_language = FILENAME_LANGUAGES[language]
     
-    # 处理日期
-    raw_date = old_format.group(2)
-    date_str = (datetime.strptime(raw_date, "%Y-%m-%d").strftime("%Y%m%d") 
-                if '-' in raw_date else raw_date)
-    
-    if DEBUG_MODE:
-        print("\n📝 Processing steps:")
-    
-    content = get_image_content(image_path)
-    if not content:
+    if provider == 'ollama':
+        payload = {
+            "model": "qwen2.5:32b",
+            "prompt": (
+                f"任务：将英文描述转换为{target_language}文件名\n\n"
+                f"描述：{content}\n\n"
+                f"要求：\n"
+                f"1. 建议长度在10个字符以内\n"
+                f"2. 保留最核心的含义\n"
+                f"3. 不要解释和标点\n"
+                f"4. 无法总结时输出skip\n\n"
+                f"示例：\n"
+                f"输入：Code editor with Python syntax highlighting\n"
+                f"输出：编程器\n\n"
+                f"输入：Soccer match between two teams on field\n"
+                f"输出：足球赛\n\n"
+                f"输入：Bicycle parking in front of building\n"
+                f"输出：单车位\n\n"
+                f"直接输出文件名："
+            ),
+            "stream": True,
+            "options": {
+                "temperature": 0.1,
+                "top_p": 0.9,
+                "num_predict": 10,
+                "stop": ["\n", "。", "，", ".", ",", "：", "\"", "'"]
+            }
+        }
+        
         if DEBUG_MODE:
-            print("❌ Image recognition failed")
-        return None
+            print("\n🔍 Step 2 - Filename Generation:")
+            print(f"Input content: {content}")
+            print(f"Using model: qwen2.5:32b")
+            
+        response = SESSION.post(
+            "http://localhost:11434/api/generate",
+            data=json_dumps(payload),
+            headers=HEADERS,
+            timeout=20,
+            stream=True
+        )
         
-    description = generate_filename(content)
-    if not description or description.lower() == 'skip':
+        if response.status_code != 200:
+            if DEBUG_MODE:
+                print(f"Error response: {response.text}")
+            response.close()  # 流式响应未读完，关闭以归还连接
+            raise Exception(f"API Error: Status {response.status_code}")
+            
+        result = read_ollama_stream(response)
         if DEBUG_MODE:
-            print("❌ Filename generation failed")
-        return None
+            print(f"Raw response: {redact_for_debug(result)}")
+            
+        # 清理响应文本
+        filename = result.get('response', '').strip()
+        filename = SPECIAL_CHARS_RE.sub('', filename)  # 移除特殊字符
+        filename = WHITESPACE_RE.sub(' ', filename).strip()  # 规范化空格
+        
+        if DEBUG_MODE:
+            print(f"Cleaned filename: {filename}")
+        
+        # 只检查基本错误
+        if not filename or filename.lower() == 'skip':
+            return 'skip'
+        
+        return filename
+        
+    # 对于其他 API，使用原来的方式
+    prompt = (
+        f"Based on this description: '{content}'\n"
+        f"Create a very concise filename in {target_language}.\n"
+        f"Requirements:\n"
+        f"- For Chinese: exactly 2-4 characters\n"
+        f"- For other languages: exactly 2-3 words\n"
+        f"- No sentences, no articles\n"
+        f"- Only core meaning\n"
+        f"Examples:\n"
+        f"- '代码编辑器' not '这是一个代码编辑器界面'\n"
+        f"- 'Tokyo Station' not 'This is Tokyo Station'\n"
+        f"If unsure, reply 'skip'"
+    )
+    
+    headers = HEADERS
+    payload = API_CONFIG['payload_format'](API_CONFIG['model'], prompt, "")
     
     if DEBUG_MODE:
-        print(f"✅ Final filename: {description}")
+        print("\n🔍 Debug Information (Filename Generation):")
+        print(f"Content: {content}")
+        print(f"Prompt: {prompt}")
+    
+    response = SESSION.post(
+        API_CONFIG['base_url'],
+        data=json_dumps(payload),
+        headers=headers,
+        timeout=20
+    )
+    
+    if response.status_code != 200:
+        raise Exception(f"API Error: Status {response.status_code}")
+        
+    result = json_loads(response.content)
+    # 与 Ollama 分支一致地清理，空回复与 skip 统一为 'skip'，缓存才会按 skip 的有效期过期
+    filename = SPECIAL_CHARS_RE.sub('', API_CONFIG['response_parser'](result))
+    filename = WHITESPACE_RE.sub(' ', filename).strip()
+    if not filename or is_skip(filename):
+        return 'skip'
+    return filename
+
+def sanitize_description(description):
+    """单次遍历清理描述：空格转下划线，仅保留文字、数字、下划线和连字符，并合并连续的 _ 与 -"""
+    out = []
+    prev = ''
+    for c in description:
+        if c == ' ':
+            c = '_'
+        if not (c.isalnum() or c == '_' or c == '-' or '\u4e00' <= c <= '\u9fff'):
+            continue
+        if c == prev and c in '_-':
+            continue
+        out.append(c)
+        prev = c
+    return ''.join(out)
+
+def name_key(name):
+    """文件名查重用的键：macOS 等文件系统不区分大小写及 Unicode 正规化形式"""
+    return unicodedata.normalize('NFC', name).casefold()
+
+def rename_file(src, dst):
+    """不覆盖已有文件的重命名，目标已存在时抛出 FileExistsError"""
+    try:
+        # 硬链接在目标存在时原子地失败，查重与占用名称只需一次系统调用
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        # 文件系统不支持硬链接（如 FAT/exFAT），退回到先检查再 rename
+        if os.path.exists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    
+    try:
+        os.unlink(src)
+    except OSError:
+        os.unlink(dst)
+        raise
+
+def process_filename(image_path, date_str, description, dir_names=None):
+    """根据描述生成新文件名并重命名，返回新路径
+
+    date_str 为目录遍历时从文件名解析出的 YYYYMMDD 日期；dir_names 为
+    {目录: (已有文件名键集合, {文件名主干: 下一个序号})}，在多次调用间共享，
+    每个目录只读取一次
+    """
+    dir_path = os.path.dirname(image_path)
     
     # 清理文件名
-    clean_desc = re.sub(r'[^\w\u4e00-\u9fff-]', '', description.replace(' ', '_'))
-    clean_desc = re.sub(r'_+', '_', clean_desc)
-    clean_desc = re.sub(r'-+', '-', clean_desc)
-    clean_desc = clean_desc.strip('_-')
+    clean_desc = sanitize_description(description).strip('_-')
     
     if not clean_desc:
         return None
     
-    # 生成带自增的文件名
+    # 生成带自增的文件名：一次读取目录，之后在内存中查重，不再逐个 stat
     base_name = f"{date_str}-{clean_desc}.png"
     name_part, ext = os.path.splitext(base_name)
-    counter = 1
-    new_name = os.path.join(dir_path, base_name)
+    if dir_names is None:
+        dir_names = {}
+    cached = dir_names.get(dir_path)
+    if cached is None:
+        cached = dir_names[dir_path] = ({name_key(entry.name) for entry in os.scandir(dir_path)}, {})
+    existing, counters = cached
+    # 同一主干从上次用到的序号继续，不必每次从 1 开始逐个查重
+    stem = name_key(name_part)
+    counter = counters.get(stem, 0)
     
-    while os.path.exists(new_name):
-        new_name = os.path.join(dir_path, f"{name_part}-{counter}{ext}")
+    while True:
+        candidate = f"{name_part}-{counter}{ext}" if counter else base_name
+        if name_key(candidate) not in existing:
+            new_name = os.path.join(dir_path, candidate)
+            try:
+                rename_file(image_path, new_name)
+                existing.add(name_key(candidate))
+                existing.discard(name_key(os.path.basename(image_path)))
+                counters[stem] = counter + 1
+                return new_name
+            except FileExistsError:
+                # 读取目录后又出现了同名文件
+                existing.add(name_key(candidate))
         counter += 1
-    
-    return new_name
 
-def process_directory(target_dir):
+def iter_screenshots(root):
+    """遍历目录树，产出符合截图命名的 (图片路径, YYYYMMDD 日期)"""
+    # 以显式栈代替递归：不受递归深度限制，同一时刻只打开一个目录句柄
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue  # 与 os.walk 一致，跳过无法读取的目录
+        with it:
+            for entry in it:
+                # DirEntry 的类型信息来自 readdir，无需逐个 stat
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                # 先做锚定前缀匹配，绝大多数无关文件在首个字符即被排除；
+                # 扩展名检查只需处理后缀
+                elif ((match := SCREENSHOT_RE.match(entry.name))
+                      and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS
+                      and entry.is_file(follow_symlinks=False)):
+                    yield entry.path, match.group(2).replace('-', '')  # YYYY-MM-DD -> YYYYMMDD
+
+def process_directory(target_dir, concurrency=DEFAULT_CONCURRENCY, use_cache=True, batch_size=1):
     """处理目录"""
-    valid_files = []
-    for root, _, files in os.walk(target_dir):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                full_path = os.path.join(root, file)
-                if re.match(r"^(Screen Shot|SCR)-(\d{4}(-\d{2}){2}|\d{8})", file):
-                    valid_files.append(full_path)
+    valid_files = list(iter_screenshots(target_dir))
     
     total = len(valid_files)
     print(f"📂 发现 {total} 个待处理文件\n")
     
-    for idx, path in enumerate(valid_files, 1):
-        print(f"\n{'='*50}")
-        print(f"🔧 处理文件 ({idx}/{total}): {os.path.basename(path)}")
-        print(f"{'='*50}")
+    cache = None
+    if use_cache:
+        try:
+            cache = open_cache()
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️ 无法打开缓存，将不使用缓存: {str(e)}")
+    
+    try:
+        asyncio.run(process_files(valid_files, concurrency, cache, batch_size))
+    finally:
+        # 提交剩余未提交的写入
+        if cache is not None:
+            try:
+                cache.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ 无法保存缓存: {str(e)}")
+            cache.close()
+
+async def process_files(valid_files, concurrency, cache=None, batch_size=1):
+    """并发处理所有文件，同时进行的 API 请求最多 concurrency 个
+
+    按请求而不是按文件限流，形成流水线：
+    一个文件在生成文件名时，后续文件的图片识别可以同时进行，
+    再后面的图片也已在线程池中读取编码，不占用识别请求的名额。
+    batch_size 大于 1 时每 batch_size 张图片合并为一次识别请求
+    """
+    # 阻塞的读文件、编码和 HTTP 请求在线程池中执行；预读编码与识别共用最多 2 倍并发数，
+    # 加上文件名生成共需 3 倍线程，默认线程池在 CPU 核数少的机器上可能不够
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=3 * concurrency, thread_name_prefix='snapsweaper')
+    )
+    # 预读名额从读取编码开始占用到识别请求结束，按请求计：内存中的已编码图片
+    # 最多 2 倍并发数个请求的量，批量识别时即 2 × concurrency × batch_size 张
+    prefetch_semaphore = asyncio.Semaphore(2 * concurrency)
+    vision_semaphore = asyncio.Semaphore(concurrency)
+    # 在线 API 的两个阶段请求同一服务、共用限流额度，因此共用名额；
+    # 本地 Ollama 两个阶段使用不同模型，各自最多 concurrency 个请求。
+    # 调试模式下同样共用名额，同一时刻只有一个请求在打印调试信息
+    if API_PROVIDER == 'ollama' and not DEBUG_MODE:
+        name_semaphore = asyncio.Semaphore(concurrency)
+    else:
+        name_semaphore = vision_semaphore
+    total = len(valid_files)
+    dir_names = {}  # 各目录已有文件名，供查重共享
+    
+    # 输出按文件顺序打印：先完成的文件暂存结果，等前面的文件都输出后再打印
+    pending = {}
+    next_idx = 1
+    
+    async def run(idx, path, date_str, recognized=None):
+        nonlocal next_idx
+        pending[idx] = await process_file(idx, total, path, date_str,
+                                          prefetch_semaphore, vision_semaphore,
+                                          name_semaphore, cache, dir_names, recognized)
+        # 已按顺序就绪的文件输出合并为一次写入
+        ready = []
+        while next_idx in pending:
+            ready.extend(pending.pop(next_idx))
+            next_idx += 1
+        if ready:
+            ready.append('')
+            sys.stdout.write("\n".join(ready))
+    
+    async def run_batch(batch):
+        try:
+            recognized = await recognize_files([path for _, (path, _) in batch], cache,
+                                               prefetch_semaphore, vision_semaphore)
+        except Exception:
+            # 交由各文件单独识别，错误记录在各自的输出中
+            recognized = [None] * len(batch)
+        await asyncio.gather(*(
+            run(idx, path, date_str, result)
+            for (idx, (path, date_str)), result in zip(batch, recognized)
+        ))
+    
+    files = list(enumerate(valid_files, 1))
+    if batch_size > 1:
+        await asyncio.gather(*(
+            run_batch(files[i:i + batch_size])
+            for i in range(0, len(files), batch_size)
+        ))
+    else:
+        await asyncio.gather(*(run(idx, path, date_str) for idx, (path, date_str) in files))
+
+async def recognize_files(paths, cache, prefetch_semaphore, vision_semaphore):
+    """识别一组图片，返回 [(识别结果, 是否来自缓存, 未发送请求的原因), ...]
+
+    读取、查缓存与编码占用 prefetch 名额，识别请求占用 vision 名额：
+    前面的请求进行中时后续图片即可提前编码，而 prefetch 名额在请求结束后才释放，
+    已编码待发送的图片数量因此有上限（每个名额对应一次请求的全部图片）。
+    未命中缓存的图片超过一张时合并为一次批量请求，批量请求失败时退回逐张识别
+    """
+    loop = asyncio.get_running_loop()
+    results = [None] * len(paths)
+    keys = [None] * len(paths)
+    misses = []
+    
+    async with prefetch_semaphore:
+        for i, path in enumerate(paths):
+            if cache is not None:
+                digest = await loop.run_in_executor(None, hash_file, path)
+                keys[i] = content_cache_key(digest)
+                content = cache_get(cache, keys[i])
+                if content is not None:
+                    results[i] = (content, True, None)
+                    continue
+            misses.append(i)
+        
+        # base64 上传时预先编码；分段上传直接读取原文件，只需预先检查
+        prepare = encode_image if API_CONFIG['upload_mode'] == 'base64' else check_upload
+        prepared = await asyncio.gather(*(
+            loop.run_in_executor(None, prepare, paths[i]) for i in misses
+        ), return_exceptions=True)
+        ready = []
+        for i, data in zip(misses, prepared):
+            if isinstance(data, Exception):
+                # 非图片文件或原图过大，不必发送请求；原因记入该文件的输出
+                results[i] = (None, False, str(data))
+            else:
+                ready.append((i, data))
         
+        if not ready:
+            return results
+        
+        async with vision_semaphore:
+            contents = None
+            if len(ready) > 1:
+                contents = await loop.run_in_executor(
+                    None, get_images_content,
+                    [paths[i] for i, _ in ready], [data for _, data in ready]
+                )
+            if contents is None:
+                contents = [
+                    await loop.run_in_executor(None, get_image_content, paths[i], data)
+                    for i, data in ready
+                ]
+    
+    for (i, _), content in zip(ready, contents):
+        cache_put(cache, keys[i], content)
+        results[i] = (content, False, None)
+    return results
+
+async def process_file(idx, total, path, date_str, prefetch_semaphore, vision_semaphore,
+                       name_semaphore, cache=None, dir_names=None, recognized=None):
+    """处理单个文件：识别、生成文件名并重命名，返回该文件的输出内容
+
+    recognized 为批量识别已得到的 (识别结果, 是否来自缓存, 未发送请求的原因)，此时跳过识别请求
+    """
+    loop = asyncio.get_running_loop()
+    # 多个文件同时处理，输出先缓存，由调用方一次性打印，避免交错
+    log = [
+        f"\n{BANNER}",
+        f"🔧 处理文件 ({idx}/{total}): {os.path.basename(path)}",
+        BANNER
+    ]
+    
+    try:
         # Step 1: 图片识别
-        print("\n📸 Step 1: 图片识别")
-        content = get_image_content(path)
-        if not content:
-            print("❌ 图片识别失败")
-            continue
-        print(f"✅ 识别结果: {content}")
+        log.append("\n📸 Step 1: 图片识别")
+        if recognized is None:
+            [recognized] = await recognize_files([path], cache,
+                                                 prefetch_semaphore, vision_semaphore)
+        content, from_cache, error = recognized
+        if not content or content == 'skip':
+            if error:
+                log.append(f"❌ 无法上传图片: {error}")
+            log.append("❌ 图片识别失败")
+            return log
+        log.append(f"✅ 识别结果: {content}{' (缓存)' if from_cache else ''}")
         
         # Step 2: 生成文件名
-        print("\n📝 Step 2: 生成文件名")
-        description = generate_filename(content)
+        log.append("\n📝 Step 2: 生成文件名")
+        filename_key = filename_cache_key(content) if cache is not None else None
+        description = cache_get(cache, filename_key)
+        from_cache = description is not None
+        if not from_cache:
+            try:
+                async with name_semaphore:
+                    description = await loop.run_in_executor(None, generate_filename, content)
+            except Exception as e:
+                # 错误记入本文件的输出，不直接打印，以免与其他文件的输出交错
+                log.append(f"❌ 错误：{str(e)}")
+                description = None
+            cache_put(cache, filename_key, description)
         if not description or description.lower() == 'skip':
-            print("❌ 文件名生成失败")
-            continue
-        print(f"✅ 生成文件名: {description}")
+            if description:
+                log.append("❌ 错误：模型无法生成合适的文件名")
+            log.append("❌ 文件名生成失败")
+            return log
+        log.append(f"✅ 生成文件名: {description}{' (缓存)' if from_cache else ''}")
         
         # Step 3: 重命名文件
-        if new_name := process_filename(path):
-            try:
-                os.rename(path, new_name)
-                print(f"\n✨ 最终结果: {os.path.basename(new_name)}")
-            except Exception as e:
-                print(f"❗ 重命名失败: {str(e)}")
+        # 在事件循环线程中执行，查重与重命名不会与其他文件交错
+        try:
+            new_name = process_filename(path, date_str, description, dir_names)
+        except Exception as e:
+            log.append(f"❗ 重命名失败: {str(e)}")
         else:
-            print("❌ 文件名处理失败")
+            if new_name:
+                log.append(f"\n✨ 最终结果: {os.path.basename(new_name)}")
+            else:
+                log.append("❌ 文件名处理失败")
         
-        print(f"\n{'='*50}\n")
+        log.append(f"\n{BANNER}\n")
+    except Exception as e:
+        # 单个文件的意外错误（如处理中途文件被移走）不应中断其他文件
+        log.append(f"❌ 处理失败: {str(e)}")
+    
+    return log
 
 def main():
     """Main entry point"""
+    global LANGUAGE, API_PROVIDER, API_CONFIG, API_KEY, HEADERS, DEBUG_MODE, RESIZE_IMAGES, RESIZE_MAX_DIM
     print(f"SnapSweaper v1.0")
     print("Created by Nick C.\n")
     
     parser = argparse.ArgumentParser(description="SnapSweaper Image Organizer")
     parser.add_argument('path', nargs='?', default=os.getcwd(), help="Target directory")
-    parser.add_argument('--lang', choices=['zh-cn', 'zh-tw', 'en', 'jp'], 
+    parser.add_argument('--lang', choices=list(FILENAME_LANGUAGES), 
                        default='zh-tw', help="Output language")
     parser.add_argument('--api', choices=list(API_CONFIGS.keys()),
                        default='openai', help="API provider")
     parser.add_argument('--debug', action='store_true',
                        help="Enable debug mode for detailed API information")
+    parser.add_argument('--no-resize', action='store_true',
+                       help="Upload original images without downscaling")
+    parser.add_argument('--max-dim', type=int, default=RESIZE_MAX_DIM,
+                       help="Longest side in pixels when downscaling images")
+    parser.add_argument('--no-cache', action='store_true',
+                       help="Always call the API instead of reusing cached results")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                       help="Maximum number of concurrent API requests (per model for Ollama)")
+    parser.add_argument('--batch-size', type=int, default=1,
+                       help="Number of images recognized per API request (OpenAI/DashScope)")
     args = parser.parse_args()
     
-    global LANGUAGE, API_PROVIDER, API_CONFIG, API_KEY, DEBUG_MODE
     LANGUAGE = args.lang
     API_PROVIDER = args.api
     API_CONFIG = API_CONFIGS[API_PROVIDER]
@@ -443,8 +1080,37 @@ def main():
         print(f"Error: Missing {API_CONFIG['key_env']} environment variable")
         return
     
+    HEADERS = API_CONFIG['headers'](API_KEY)
+    if API_PROVIDER == 'ollama':
+        # 本地服务无需代理，跳过每次请求的代理环境变量查找
+        SESSION.trust_env = False
+        # 启动时检查一次服务与模型，而不是每张图片都检查
+        try:
+            check_ollama_service()
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            return
+    
     print(f"Using {API_PROVIDER.upper()} API")
     
+    if args.concurrency < 1:
+        print(f"Error: Invalid concurrency - {args.concurrency}")
+        return
+    
+    if args.max_dim < 1:
+        print(f"Error: Invalid max dimension - {args.max_dim}")
+        return
+    
+    if args.batch_size < 1:
+        print(f"Error: Invalid batch size - {args.batch_size}")
+        return
+    
+    batch_size = args.batch_size
+    if batch_size > 1 and (not API_CONFIG.get('batch_payload_format')
+                           or API_CONFIG['upload_mode'] != 'base64'):
+        print(f"⚠️ {API_PROVIDER.upper()} API 不支持批量识别，将逐张处理")
+        batch_size = 1
+    
     if not os.path.isdir(args.path):
         print(f"Error: Invalid directory - {args.path}")
         return
@@ -452,7 +1118,17 @@ def main():
     print(f"\n🛠️ Starting processing: {os.path.abspath(args.path)}")
     DEBUG_MODE = args.debug
     
-    process_directory(args.path)
+    concurrency = args.concurrency
+    if DEBUG_MODE and concurrency != 1:
+        # 多个线程同时打印的调试信息会相互交错，逐个请求处理才能看清每次请求
+        print("🔍 调试模式下逐个处理请求，忽略 --concurrency")
+        concurrency = 1
+    mount_adapter(2 * concurrency)
+    RESIZE_IMAGES = not args.no_resize
+    RESIZE_MAX_DIM = args.max_dim
+    
+    process_directory(args.path, concurrency, use_cache=not args.no_cache,
+                      batch_size=batch_size)
     print("\n✅ Processing completed!")
 
 if __name__ == "__main__":